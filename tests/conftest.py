@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# The app modules live next to streamlit_app.py (Streamlit puts that folder on sys.path)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workshop_app_streamlit"))
+
+from storage import open_postgres, open_sqlite  # noqa: E402
+
+
+def _postgres_url(request):
+    # WORKSHOP_TEST_PG_URL points at an existing throwaway database; otherwise
+    # pytest-postgresql starts a local server. Skipped when neither is available.
+    pytest.importorskip("psycopg2")
+    url = os.environ.get("WORKSHOP_TEST_PG_URL")
+    if url:
+        return url
+    try:
+        conn = request.getfixturevalue("postgresql")
+    except Exception as e:  # plugin missing or no PostgreSQL binaries on this machine
+        pytest.skip(f"No local PostgreSQL server available: {e}")
+    info = conn.info
+    return f"postgresql://{info.user}:{info.password or ''}@{info.host}:{info.port}/{info.dbname}"
+
+
+def _reset_postgres(url):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA public CASCADE")
+            cur.execute("CREATE SCHEMA public")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return open_sqlite(str(tmp_path / "users.db"))
+    url = _postgres_url(request)
+    _reset_postgres(url)
+    return open_postgres(url)
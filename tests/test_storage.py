@@ -0,0 +1,374 @@
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from storage import (
+    ADMIN_JOB_KEEP,
+    ADMIN_JOB_RESULT_TTL_SECONDS,
+    ADMIN_JOB_STALE_SECONDS,
+    PAYMENT_JOB_LEASE_SECONDS,
+    PAYMENT_JOB_MAX_ATTEMPTS,
+    PAYMENT_JOB_RETRY_SECONDS,
+    TEAM_COLUMNS,
+    Storage,
+    open_sqlite,
+)
+
+DUO = "Duo (₹80)"
+SINGLE = "Single (₹50)"
+
+
+def member(name, year="2", branch="CSD", section="A"):
+    return [name, f"REG-{name}", year, branch, section]
+
+
+def make_bundle(**overrides):
+    bundle = {
+        "version": 1,
+        "team_code": "DAVTEAM-TEST",
+        "team_size": DUO,
+        "price": 80,
+        "members": [{"name": "Asha", "reg": "R1"}],
+        "qr_png": b"\x89PNG\x00qr",
+        "pdf": b"%PDF-1.4\x00body",
+    }
+    bundle.update(overrides)
+    return bundle
+
+
+def test_sql_rewrites_placeholders_for_format_paramstyle():
+    fmt = SimpleNamespace(_paramstyle="format")
+    qmark = SimpleNamespace(_paramstyle="qmark")
+    query = "SELECT 1 FROM users WHERE username=? AND password=?"
+    assert Storage._sql(fmt, query) == "SELECT 1 FROM users WHERE username=%s AND password=%s"
+    assert Storage._sql(qmark, query) == query
+
+
+def test_users(store):
+    assert not store.user_exists("a@x.in")
+    store.create_user("a@x.in", "pw")
+    assert store.user_exists("a@x.in")
+    assert store.check_login("a@x.in", "pw")
+    assert not store.check_login("a@x.in", "wrong")
+    assert store.list_usernames() == ["a@x.in"]
+
+
+def test_sessions_expire(store):
+    store.create_session("tok1", "a@x.in", False, expires_at=200)
+    store.create_session("tok2", "admin", True, expires_at=50)
+    assert store.get_session("tok1", now=100) == ("a@x.in", False)
+    assert store.get_session("tok2", now=100) is None
+    assert store.delete_expired_sessions(now=100) == 1
+    store.delete_session("tok1")
+    assert store.get_session("tok1", now=100) is None
+
+
+def test_setting_first_writer_wins(store):
+    results = []
+    threads = [
+        threading.Thread(target=lambda v=v: results.append(store.get_or_create_setting("secret", v)))
+        for v in ["a", "b", "c", "d"]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results)) == 1
+    assert store.get_or_create_setting("secret", "z") == results[0]
+
+
+def test_existing_setting_is_read_without_the_write_lock(tmp_path):
+    path = str(tmp_path / "users.db")
+    store = open_sqlite(path)
+    store.get_or_create_setting("secret", "a")
+    writer = sqlite3.connect(path, timeout=0)
+    writer.execute("BEGIN IMMEDIATE")  # e.g. a restore or wipe in progress
+    try:
+        assert store.get_or_create_setting("secret", "b") == "a"
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_team_and_bundle_round_trip(store):
+    details = member("Asha") + member("Ravi", year="3")
+    store.save_team("a@x.in", DUO, details, make_bundle())
+    row = store.get_team("a@x.in")
+    assert row[:2] == ("a@x.in", DUO)
+    assert list(row[2:12]) == details and list(row[12:]) == [""] * 5
+    assert store.has_team("a@x.in")
+
+    bundle = store.get_team_bundle("a@x.in")
+    assert bundle == make_bundle()
+    assert type(bundle["qr_png"]) is bytes and type(bundle["pdf"]) is bytes
+
+    # Saving again replaces both rows
+    store.save_team("a@x.in", SINGLE, member("Asha"), make_bundle(team_size=SINGLE, price=50))
+    assert store.get_team("a@x.in")[1] == SINGLE
+    assert store.get_team_bundle("a@x.in")["price"] == 50
+    assert store.get_team_bundle("nobody") is None
+
+
+def test_bundle_reads_only_requested_blobs(store):
+    store.save_team("a@x.in", DUO, member("Asha"), make_bundle())
+    header = store.get_team_bundle("a@x.in", blobs=())
+    assert header["price"] == 80 and "qr_png" not in header and "pdf" not in header
+    with_pdf = store.get_team_bundle("a@x.in", blobs=("pdf",))
+    assert with_pdf["pdf"] == make_bundle()["pdf"] and "qr_png" not in with_pdf
+    with pytest.raises(ValueError):
+        store.get_team_bundle("a@x.in", blobs=("password",))
+
+
+def test_transaction_creates_one_payment_job(store):
+    store.add_transaction("a@x.in", 80, "T1", b"\xff\xd8screenshot")
+    assert store.txn_exists("T1")
+    assert store.get_screenshot("T1") == b"\xff\xd8screenshot"
+    assert store.claimable_payment_jobs() == ["T1"]
+
+    assert store.claim_payment_job("T1")
+    assert not store.claim_payment_job("T1")
+    assert store.claimable_payment_jobs() == []
+
+    store.finish_payment_job("T1", "done")
+    assert store.latest_payment_job("a@x.in")[3] == "done"
+
+
+def test_payment_job_lease_expires(store):
+    store.add_transaction("a@x.in", 80, "T1", b"img")
+    assert store.claim_payment_job("T1", now=1000)
+    # The worker died: nothing can take the job while the lease holds, anyone can after
+    assert not store.claim_payment_job("T1", now=1000 + PAYMENT_JOB_LEASE_SECONDS - 1)
+    assert store.claimable_payment_jobs(now=1000 + PAYMENT_JOB_LEASE_SECONDS) == ["T1"]
+    assert store.claim_payment_job("T1", now=1000 + PAYMENT_JOB_LEASE_SECONDS)
+    assert store.get_payment_job("T1")[3:] == ("running", None, 2)
+
+
+def test_failed_payment_job_retries_are_bounded(store):
+    store.add_transaction("a@x.in", 80, "T1", b"img")
+    now = 1000
+    for attempt in range(1, PAYMENT_JOB_MAX_ATTEMPTS + 1):
+        assert store.claim_payment_job("T1", now=now)
+        store.finish_payment_job("T1", "failed", "smtp down", now=now)
+        assert not store.claim_payment_job("T1", now=now + PAYMENT_JOB_RETRY_SECONDS - 1)
+        now += PAYMENT_JOB_RETRY_SECONDS
+    assert store.get_payment_job("T1")[3:] == ("failed", "smtp down", PAYMENT_JOB_MAX_ATTEMPTS)
+    assert store.claimable_payment_jobs(now=now + 10 ** 6) == []
+
+
+def test_old_payment_jobs_table_is_migrated(tmp_path):
+    path = str(tmp_path / "users.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE payment_jobs (txn_id TEXT PRIMARY KEY, username TEXT, amount INTEGER,
+                    status TEXT, pdf BLOB, error TEXT, created_at INTEGER, updated_at INTEGER)""")
+    conn.execute("INSERT INTO payment_jobs VALUES ('T1', 'a@x.in', 80, 'running', NULL, NULL, 1000, 1000)")
+    conn.commit()
+    conn.close()
+
+    store = open_sqlite(path)
+    assert store.claimable_payment_jobs(now=1000 + PAYMENT_JOB_LEASE_SECONDS) == ["T1"]
+    assert store.claim_payment_job("T1", now=1000 + PAYMENT_JOB_LEASE_SECONDS)
+
+
+def test_screenshot_thumbs(store):
+    store.add_transaction("a@x.in", 50, "T1", b"img1")
+    store.add_transaction("b@x.in", 50, "T2", b"img2")
+    store.save_screenshot_thumb("T1", b"thumb1")
+    assert store.txn_ids_without_thumb() == ["T2"]
+    assert store.screenshot_thumbs(["T1", "T2"]) == {"T1": b"thumb1"}
+    assert store.screenshot_thumbs([]) == {}
+
+
+def test_admin_jobs(store):
+    store.create_admin_job("j1", "export_registrations")
+    assert store.list_admin_jobs()[0][2] == "queued"
+    assert store.start_admin_job("j1")
+    assert not store.start_admin_job("j1")
+    assert store.update_admin_job("j1", 1, 4, "Exported 1 of 4 rows")
+    assert store.update_admin_job("j1", 2)
+    job = store.list_admin_jobs()[0]
+    assert job[:6] == ("j1", "export_registrations", "running", 2, 4, "Exported 1 of 4 rows")
+
+    store.append_admin_job_chunk("j1", 0, b"a,b\n")
+    store.append_admin_job_chunk("j1", 1, b"1,2\n")
+    assert store.finish_admin_job("j1", "done", "ok", "registrations.csv")
+    assert store.list_admin_jobs()[0][2] == "done"
+    assert store.get_admin_job_result("j1") == b"a,b\n1,2\n"
+    # A finished job can't be moved again
+    assert not store.update_admin_job("j1", 3)
+    assert not store.finish_admin_job("j1", "failed", "late")
+
+
+def test_stale_admin_jobs_are_interrupted_and_pruned(store):
+    store.create_admin_job("queued", "feedback")
+    store.create_admin_job("export", "export_registrations")
+    store.start_admin_job("export")
+    store.append_admin_job_chunk("export", 0, b"a@x.in,REG1")  # partial file of a dead process
+    now = store.list_admin_jobs()[0][7]
+
+    assert store.mark_stale_admin_jobs(now + ADMIN_JOB_STALE_SECONDS - 1) == 0
+    store.prune_admin_jobs(now + ADMIN_JOB_STALE_SECONDS)
+    assert {job[2] for job in store.list_admin_jobs()} == {"interrupted"}
+    assert store.get_admin_job_result("export") is None
+    # The worker that picks up the queued job (or the dead export's progress) finds it gone
+    assert not store.start_admin_job("queued")
+    assert not store.update_admin_job("export", 2)
+
+
+def test_csv_export_is_written_in_chunks(store):
+    for i in range(5):
+        store.save_team(f"u{i}", SINGLE, member(f"n{i}"))
+    store.create_admin_job("j1", "export_registrations")
+    progress = []
+    rows = store.write_csv_export("j1", "registrations", lambda *p: progress.append(p), chunk_size=2)
+
+    assert rows == 5
+    assert [p[:2] for p in progress] == [(2, 5), (4, 5), (5, 5)]
+    lines = store.get_admin_job_result("j1").decode().splitlines()
+    assert lines[0] == ",".join(TEAM_COLUMNS)
+    assert [line.split(",")[0] for line in lines[1:]] == [f"u{i}" for i in range(5)]
+
+
+def test_csv_export_total_grows_with_rows_added_mid_export(store):
+    for i in range(4):
+        store.save_team(f"u{i}", SINGLE, member(f"n{i}"))
+    store.create_admin_job("j1", "export_registrations")
+    progress = []
+
+    def on_progress(done, total, message):
+        progress.append((done, total))
+        if done == 2:
+            store.save_team("u9", SINGLE, member("late"))  # registers after the cursor
+
+    assert store.write_csv_export("j1", "registrations", on_progress, chunk_size=2) == 5
+    assert progress == [(2, 4), (4, 4), (5, 5)]
+
+
+def test_admin_job_results_and_history_are_pruned(store):
+    for i in range(ADMIN_JOB_KEEP + 5):
+        store.create_admin_job(f"j{i:02d}", "export_registrations")
+        store.start_admin_job(f"j{i:02d}")
+        store.append_admin_job_chunk(f"j{i:02d}", 0, b"csv")
+        store.finish_admin_job(f"j{i:02d}", "done", "ok", "registrations.csv")
+    with store.connection() as conn:
+        conn.cursor().execute("UPDATE admin_jobs SET created_at=CAST(SUBSTR(job_id, 2) AS INTEGER), updated_at=0")
+    store.create_admin_job("running", "feedback")
+
+    store.prune_admin_jobs(now=ADMIN_JOB_RESULT_TTL_SECONDS)
+    job_ids = [job[0] for job in store.list_admin_jobs(limit=100)]
+    assert len(job_ids) == ADMIN_JOB_KEEP
+    assert "running" in job_ids and "j05" not in job_ids and "j06" in job_ids
+    assert store.get_admin_job_result(f"j{ADMIN_JOB_KEEP + 4:02d}") is None
+
+
+def test_wipe_admin_jobs_drops_results(store):
+    store.create_admin_job("export", "export_registrations")
+    store.start_admin_job("export")
+    store.append_admin_job_chunk("export", 0, b"a@x.in,REG1")
+    store.finish_admin_job("export", "done", "ok", "registrations.csv")
+    store.create_admin_job("wipe", "wipe")
+    store.start_admin_job("wipe")
+    store.update_admin_job("wipe", 1, 8)
+
+    store.create_admin_job("running", "export_transactions")
+    store.start_admin_job("running")
+    store.append_admin_job_chunk("running", 0, b"username,amount,txn_id\n")
+
+    store.wipe_admin_jobs("wipe")
+    jobs = {job[0]: job[2] for job in store.list_admin_jobs()}
+    assert jobs == {"wipe": "running", "running": "interrupted"}
+    assert store.get_admin_job_result("export") is None
+    # The cancelled export can't report progress or finish with a truncated file
+    assert not store.update_admin_job("running", 1)
+    assert not store.finish_admin_job("running", "done", "ok", "transactions.csv")
+    store.append_admin_job_chunk("running", 1, b"a@x.in,80,T1\n")  # written before it noticed
+    store.prune_admin_jobs()
+    assert store.get_admin_job_result("running") is None
+
+
+def test_team_pages_filters_and_aggregates(store):
+    for i in range(7):
+        size, branch = (DUO, "CSD") if i % 2 else (SINGLE, "IT")
+        store.save_team(f"u{i}", size, member(f"n{i}", year=str(2 + i % 3), branch=branch))
+
+    first = store.teams_page(None, 3)
+    assert list(first["username"]) == ["u0", "u1", "u2"]
+    assert str(first["branch1"].dtype) == "category"
+    assert list(store.teams_page("u2", 3)["username"]) == ["u3", "u4", "u5"]
+    assert list(store.teams_page(None, 10, year="3")["username"]) == ["u1", "u4"]
+
+    assert store.team_size_counts() == {DUO: 3, SINGLE: 4}
+    assert store.team_size_counts(branch="IT") == {SINGLE: 4}
+    assert store.branch_counts().to_dict("records") == [{"Branch": "IT", "Count": 4}, {"Branch": "CSD", "Count": 3}]
+    assert [len(chunk) for chunk in store.iter_teams(3)] == [3, 3, 1]
+
+
+def test_transaction_pages(store):
+    for i in range(5):
+        store.add_transaction(f"u{i}", 50, f"T{i}", b"img")
+    assert store.transaction_count() == 5
+    assert list(store.transactions_page("T1", 2)["txn_id"]) == ["T2", "T3"]
+    assert [len(chunk) for chunk in store.iter_transactions(2)] == [2, 2, 1]
+
+
+def test_wipe(store):
+    store.create_user("a@x.in", "pw")
+    store.save_team("a@x.in", SINGLE, member("Asha"), make_bundle())
+    store.add_transaction("a@x.in", 50, "T1", b"img")
+    for table in store.WIPE_TABLES:
+        store.wipe_table(table)
+    assert store.list_usernames() == []
+    assert store.get_team("a@x.in") is None
+    assert not store.txn_exists("T1")
+    with pytest.raises(ValueError):
+        store.wipe_table("settings")
+
+
+# ---------- connection pool ----------
+def test_pool_releases_slot_when_connect_fails(tmp_path):
+    store = open_sqlite(str(tmp_path / "users.db"), pool_size=2)
+    store._pool_timeout = 0.5
+    real_connect = store._connect
+    while not store._pool.empty():
+        store._pool.get()
+
+    def failing_connect():
+        raise sqlite3.OperationalError("server down")
+
+    store._connect = failing_connect
+    for _ in range(3):
+        with pytest.raises(sqlite3.OperationalError):
+            store.user_exists("a@x.in")
+
+    store._connect = real_connect
+    assert not store.user_exists("a@x.in")
+
+
+def test_pool_drops_broken_connection(tmp_path):
+    store = open_sqlite(str(tmp_path / "users.db"), pool_size=1)
+    conn = store._pool.get()
+    conn.close()
+    store._pool.put(conn)
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.user_exists("a@x.in")
+    assert not store.user_exists("a@x.in")
+
+
+def test_pool_keeps_connection_after_query_error(tmp_path):
+    store = open_sqlite(str(tmp_path / "users.db"), pool_size=1)
+    store.create_user("a@x.in", "pw")
+    with pytest.raises(sqlite3.IntegrityError):
+        store.create_user("a@x.in", "pw")
+    assert store._pool.qsize() == 1
+    assert store.user_exists("a@x.in")
+
+
+def test_pool_times_out_when_exhausted(tmp_path):
+    store = open_sqlite(str(tmp_path / "users.db"), pool_size=1)
+    store._pool_timeout = 0.1
+    with store.connection():
+        with pytest.raises(TimeoutError):
+            with store.connection():
+                pass
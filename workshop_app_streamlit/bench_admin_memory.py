@@ -0,0 +1,112 @@
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from storage import open_sqlite, TEAM_COLUMNS
+
+# Memory-budget benchmark for the Admin Panel data path.
+# Seeds N registrations (and one transaction + screenshot thumbnail each) plus
+# finished full-table CSV exports, then runs the same reads the Admin Panel does
+# on one render: the Background Jobs list, SQL aggregates, one keyset page of
+# teams, one page of transactions and that page's thumbnails. The export job
+# itself is measured too. Peak traced memory of both must stay flat as N grows.
+#
+#   python workshop_app_streamlit/bench_admin_memory.py
+
+SIZES = [100, 1_000, 10_000, 100_000]
+FINISHED_EXPORTS = 3    # full-table exports sitting in the Background Jobs list
+EXPORT_CHUNK = 1000     # rows per export chunk; export growth is measured from the first N with a full chunk
+PAGE_SIZE = 51          # ADMIN_PAGE_SIZE + 1, as paged_view fetches it
+ALLOWED_GROWTH = 1.5    # peak at the largest N may be at most 1.5x the peak at the baseline N
+TEAM_SIZES = ["Single (₹50)", "Duo (₹80)", "Trio (₹100)"]
+
+
+def seed(store, n):
+    rng = random.Random(n)
+    teams, txns, thumbs = [], [], []
+    for i in range(n):
+        username = f"user{i:06d}@example.com"
+        size = rng.randint(1, 3)
+        details = []
+        for m in range(size):
+            details += [f"Name {i}-{m}", f"REG{i:06d}{m}", rng.choice(["2", "3", "4"]),
+                        rng.choice(["CSD", "CSM", "CSE", "IT"]), rng.choice(["A", "B", "C", "D"])]
+        teams.append((username, TEAM_SIZES[size - 1], *details, *[""] * (15 - len(details))))
+        txn_id = f"T{i:022d}"
+        txns.append((username, 50, txn_id, os.urandom(2048)))
+        thumbs.append((txn_id, os.urandom(512)))
+
+    placeholders = ",".join(["?"] * len(TEAM_COLUMNS))
+    with store.connection() as conn:
+        conn.executemany(f"INSERT INTO teams ({', '.join(TEAM_COLUMNS)}) VALUES ({placeholders})", teams)
+        conn.executemany("INSERT INTO transactions (username, amount, txn_id, screenshot) VALUES (?, ?, ?, ?)", txns)
+        conn.executemany("INSERT INTO screenshot_thumbs (txn_id, thumb) VALUES (?, ?)", thumbs)
+
+
+def export(store, job_id, dataset):
+    store.create_admin_job(job_id, f"export_{dataset}")
+    store.start_admin_job(job_id)
+    store.write_csv_export(job_id, dataset, chunk_size=EXPORT_CHUNK)
+    store.finish_admin_job(job_id, "done", "ok", f"{dataset}.csv")
+
+
+def admin_render(store):
+    # Background Jobs: only job rows are read; export files load on an explicit click
+    store.list_admin_jobs()
+
+    filters = {"year": "3", "branch": None, "section": None, "team_size": None}
+    store.team_size_counts()
+    store.team_size_counts(**filters)
+    store.branch_counts(**filters)
+    teams = store.teams_page(None, PAGE_SIZE, **filters)
+    store.teams_page(teams["username"].iloc[-1], PAGE_SIZE, **filters)  # "Next" page
+    txns = store.transactions_page(None, PAGE_SIZE)
+    store.screenshot_thumbs(list(txns["txn_id"]))
+
+
+def traced_peak(func, *args):
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def measure(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_sqlite(os.path.join(tmp, "bench.db"), pool_size=1)
+        seed(store, n)
+        for i in range(FINISHED_EXPORTS):
+            export(store, f"seed-{i}", "registrations")
+        admin_render(store)  # warm up imports and caches
+
+        render_peak = traced_peak(admin_render, store)
+        export_peak = traced_peak(export, store, "measured", "registrations")
+    return render_peak, export_peak
+
+
+def main():
+    peaks = {}
+    for n in SIZES:
+        peaks[n] = measure(n)
+        render_peak, export_peak = peaks[n]
+        print(f"{n:>7} registrations: render peak {render_peak / 1024:8.1f} KiB, "
+              f"export peak {export_peak / 1024:8.1f} KiB")
+
+    flat = True
+    baselines = {"render": SIZES[0], "export": min(n for n in SIZES if n >= EXPORT_CHUNK)}
+    for i, (name, base) in enumerate(baselines.items()):
+        growth = peaks[SIZES[-1]][i] / peaks[base][i]
+        print(f"{name} growth {base} -> {SIZES[-1]}: {growth:.2f}x (budget {ALLOWED_GROWTH}x)")
+        flat = flat and growth <= ALLOWED_GROWTH
+    if not flat:
+        print("❌ Admin Panel memory is not flat.")
+        return 1
+    print("✅ Admin Panel memory stays flat.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,20 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import altair as alt
 from fpdf import FPDF
+import os
+import gzip
+import glob
+import shutil
+import tempfile
+import threading
+import time
+import hmac
+import hashlib
+import secrets
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from storage import open_storage, ADMIN_JOB_STALE_SECONDS, BUNDLE_BLOBS, PAYMENT_JOB_MAX_ATTEMPTS
 
 def send_email(to_address, subject, message_body):
     sender_email = "konchadachatresh.23.csd@anits.edu.in"
@@ -30,8 +44,10 @@ def send_email(to_address, subject, message_body):
             server.login(sender_email, app_password)
             server.send_message(msg)
         print("✅ Email sent successfully.")
+        return True
     except Exception as e:
         print("❌ Email failed:", e)
+        return False
 
 
 def send_email_with_pdf(to_address, subject, message_body, pdf_bytes, filename):
@@ -57,9 +73,11 @@ def send_email_with_pdf(to_address, subject, message_body, pdf_bytes, filename):
             server.login(sender_email, app_password)
             server.send_message(msg)
         print("✅ Email sent successfully.")
+        return True
     except Exception as e:
         print("❌ Email failed:", e)
-        
+        return False
+
 def generate_team_qr(data: str):
     qr = qrcode.QRCode(box_size=8, border=2)
     qr.add_data(data)
@@ -115,31 +133,485 @@ def show_login():
 
 
 
-# Initialize DB
-def init_db():
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS teams (
-        username TEXT,
-        team_size TEXT,
-        name1 TEXT, reg1 TEXT, year1 TEXT, branch1 TEXT, section1 TEXT,
-        name2 TEXT, reg2 TEXT, year2 TEXT, branch2 TEXT, section2 TEXT,
-        name3 TEXT, reg3 TEXT, year3 TEXT, branch3 TEXT, section3 TEXT
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS transactions (
-        username TEXT,
-        amount INTEGER,
-        txn_id TEXT,
-        screenshot BLOB
-    )""")
-    conn.commit()
-    return conn
-
-conn = init_db()
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 10                      # rotated snapshots kept on disk
+BACKUP_INTERVAL_SECONDS = 6 * 60 * 60  # scheduled backup every 6 hours
+
+
+# Initialize DB (backend chosen by WORKSHOP_DB_URL, shared by all sessions of this process)
+@st.cache_resource
+def get_storage():
+    return open_storage()
+
+store = get_storage()
+DB_PATH = store.db_path  # None unless the SQLite backend is in use
+
+
+# ✅ Online backups (SQLite backup API, copied in one step from a WAL read snapshot)
+def list_backups(backup_dir=BACKUP_DIR):
+    return sorted(glob.glob(os.path.join(backup_dir, "users-*.db.gz")), reverse=True)
+
+
+def unpack_backup(snapshot_path):
+    fd, tmp_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    with gzip.open(snapshot_path, "rb") as f_in, open(tmp_path, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    return tmp_path
+
+
+def verify_backup(snapshot_path):
+    tmp_path = None
+    try:
+        tmp_path = unpack_backup(snapshot_path)
+        snap = sqlite3.connect(tmp_path)
+        try:
+            ok = snap.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+            for table in ["users", "teams", "transactions"]:
+                snap.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        finally:
+            snap.close()
+        return ok
+    except Exception as e:
+        print("❌ Backup verification failed:", e)
+        return False
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+
+def backup_db(db_path=DB_PATH, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    os.makedirs(backup_dir, exist_ok=True)
+    # Unique name: microsecond timestamp (sorts chronologically) plus a random suffix
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    snapshot_path = os.path.join(backup_dir, f"users-{stamp}-{uuid.uuid4().hex[:8]}.db.gz")
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            # One step: under WAL the copy reads a consistent snapshot while writers keep going.
+            # A stepped copy restarts on every write to the source and may never finish.
+            src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+            src.close()
+        part_path = snapshot_path + ".part"
+        try:
+            with open(tmp_path, "rb") as f_in, gzip.open(part_path, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.link(part_path, snapshot_path)  # raises FileExistsError instead of overwriting
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    finally:
+        os.remove(tmp_path)
+
+    if not verify_backup(snapshot_path):
+        os.remove(snapshot_path)
+        raise RuntimeError(f"Backup {snapshot_path} failed verification.")
+
+    # Rotate: keep only the newest snapshots
+    for old in list_backups(backup_dir)[keep:]:
+        os.remove(old)
+    return snapshot_path
+
+
+def restore_backup(snapshot_path, db_path=DB_PATH):
+    if not verify_backup(snapshot_path):
+        raise RuntimeError(f"Backup {snapshot_path} failed verification.")
+
+    # Unpack first: the safety snapshot below may rotate the chosen one away
+    tmp_path = unpack_backup(snapshot_path)
+    try:
+        # Safety snapshot of the current data before overwriting it
+        backup_db(db_path)
+
+        snap = sqlite3.connect(tmp_path)
+        live = sqlite3.connect(db_path)
+        try:
+            snap.backup(live, pages=-1)
+        finally:
+            live.close()
+            snap.close()
+    finally:
+        os.remove(tmp_path)
+
+
+@st.cache_resource
+def start_backup_scheduler():
+    # One scheduler thread per server process (cache_resource survives reruns)
+    def run():
+        while True:
+            try:
+                backups = list_backups()
+                last = os.path.getmtime(backups[0]) if backups else 0
+                if time.time() - last >= BACKUP_INTERVAL_SECONDS:
+                    path = backup_db()
+                    print("✅ Scheduled backup written:", path)
+            except Exception as e:
+                print("❌ Scheduled backup failed:", e)
+            time.sleep(60)
+
+    thread = threading.Thread(target=run, name="db-backup-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+if store.dialect == "sqlite":
+    start_backup_scheduler()
+
+# ✅ Persistent login sessions (signed token in the URL, session row in the DB)
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+ADMIN_SESSION_TTL_SECONDS = 60 * 60  # admin tokens grant full access, keep them short-lived
+SESSION_CLEANUP_SECONDS = 15 * 60
+
+
+@st.cache_resource
+def get_session_secret():
+    # Resolved once per process; the script body reruns on every interaction
+    return os.environ.get("WORKSHOP_SESSION_SECRET") or store.get_or_create_setting(
+        "session_secret", secrets.token_hex(32)
+    )
+
+
+SESSION_SECRET = get_session_secret()
+
+
+def sign_token(token):
+    sig = hmac.new(SESSION_SECRET.encode(), token.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{token}.{sig}"
+
+
+def verify_token(signed):
+    token, _, sig = signed.rpartition(".")
+    if token and hmac.compare_digest(sign_token(token), signed):
+        return token
+    return None
+
+
+def start_session(username, is_admin=False):
+    end_session()  # revoke any token this browser was already carrying
+    token = secrets.token_urlsafe(24)
+    ttl = ADMIN_SESSION_TTL_SECONDS if is_admin else SESSION_TTL_SECONDS
+    store.create_session(token, username, is_admin, int(time.time()) + ttl)
+    st.query_params["session"] = sign_token(token)
+
+
+def restore_session():
+    signed = st.query_params.get("session")
+    token = verify_token(signed) if signed else None
+    row = store.get_session(token, int(time.time())) if token else None
+    if row is None:
+        st.query_params.pop("session", None)
+        return
+    username, is_admin = row
+    if is_admin:
+        st.session_state.admin_logged_in = True
+    else:
+        st.session_state.user_logged_in = True
+        st.session_state.username = username
+
+
+def end_session():
+    signed = st.query_params.pop("session", None)
+    token = verify_token(signed) if signed else None
+    if token:
+        store.delete_session(token)
+
+
+@st.cache_resource
+def session_cleanup_state():
+    return {"last_run": 0.0}
+
+
+def cleanup_expired_sessions():
+    # At most one sweep per process every SESSION_CLEANUP_SECONDS
+    state = session_cleanup_state()
+    now = time.time()
+    if now - state["last_run"] >= SESSION_CLEANUP_SECONDS:
+        state["last_run"] = now
+        store.delete_expired_sessions(int(now))
+
+
+# ✅ Post-payment processing: one durable job per txn_id, run once in the background
+TEAM_PRICES = {"Single (₹50)": 50, "Duo (₹80)": 80, "Trio (₹100)": 100}
+TEAM_BUNDLE_VERSION = 1  # bump when the bundle layout changes; old bundles are rebuilt on read
+
+
+def members_from_details(details):
+    members = []
+    for i in range(0, len(details), 5):
+        name, reg, year, branch, section = details[i:i + 5]
+        if name and reg:
+            members.append({
+                "name": name,
+                "reg": reg,
+                "year": year,
+                "branch": branch,
+                "section": section
+            })
+    return members
+
+
+def format_team_info(team_code, members):
+    team_info = f"Team Code: {team_code}\n"
+    for i, member in enumerate(members, start=1):
+        title = "Team Leader" if i == 1 else f"Member {i}"
+        team_info += f"{title}: {member['name']} ({member['reg']})\n"
+    return team_info
+
+
+def build_team_bundle(username, team_size, details, team_code=None):
+    # Everything later pages and emails need, computed once when the team is saved
+    team_code = team_code or f"DAVTEAM-{uuid.uuid4().hex[:8].upper()}"
+    members = members_from_details(details)
+    team_data = {"team_size": team_size, "members": members}
+    return {
+        "version": TEAM_BUNDLE_VERSION,
+        "team_code": team_code,
+        "team_size": team_size,
+        "price": TEAM_PRICES.get(team_size),
+        "members": members,
+        "qr_png": generate_team_qr(format_team_info(team_code, members)),
+        "pdf": generate_team_pdf(team_data, username).getvalue(),
+    }
+
+
+def get_team_bundle(username, blobs=BUNDLE_BLOBS):
+    bundle = store.get_team_bundle(username, blobs)
+    if bundle and bundle["version"] == TEAM_BUNDLE_VERSION:
+        return bundle
+
+    # Teams saved before bundles existed (or with an old layout): rebuild once and store
+    team_row = store.get_team(username)
+    if not team_row:
+        return None
+    bundle = build_team_bundle(username, team_row[1], list(team_row[2:]),
+                               team_code=bundle["team_code"] if bundle else None)
+    store.save_team_bundle(username, bundle)
+    return bundle
+
+
+def process_payment_job(txn_id):
+    if not store.claim_payment_job(txn_id):
+        return  # already taken by another worker
+    try:
+        _, username, amount, _, _, _ = store.get_payment_job(txn_id)
+        bundle = get_team_bundle(username, blobs=("pdf",))
+        if not bundle:
+            raise RuntimeError("No team details found for this user.")
+
+        pdf_bytes = bundle["pdf"]
+        sent = send_email_with_pdf(
+            to_address=username,
+            subject="Workshop Payment Received 💰",
+            message_body=(
+                f"Hi,\n\nYour payment of ₹{amount} was received successfully. "
+                f"Your transaction ID is: {txn_id}.\n\n"
+                f"Attached is your team confirmation.\n\nThanks for registering!"
+            ),
+            pdf_bytes=io.BytesIO(pdf_bytes),
+            filename="team_info.pdf"
+        )
+        if sent:
+            store.finish_payment_job(txn_id, "done")
+        else:
+            store.finish_payment_job(txn_id, "failed", "Confirmation email could not be sent.")
+    except Exception as e:
+        print("❌ Payment job failed:", e)
+        store.finish_payment_job(txn_id, "failed", str(e))
+
+
+@st.cache_resource
+def start_payment_worker():
+    wake = threading.Event()
+
+    def run():
+        while True:
+            wake.wait(timeout=5)
+            wake.clear()
+            try:
+                # New jobs, jobs whose worker died (expired lease) and failed sends due a retry
+                for txn_id in store.claimable_payment_jobs():
+                    process_payment_job(txn_id)
+            except Exception as e:
+                print("❌ Payment worker error:", e)
+
+    threading.Thread(target=run, name="payment-worker", daemon=True).start()
+    return wake
+
+
+payment_worker_wake = start_payment_worker()
+
+
+# ✅ Background admin jobs: a small thread pool, with status/progress persisted in admin_jobs
+ADMIN_JOB_POLL_SECONDS = 3  # the Background Jobs section re-reads job status this often
+ADMIN_JOB_LABELS = {
+    "feedback": "📩 Feedback emails",
+    "previews": "🖼️ Screenshot previews",
+    "export_registrations": "📁 Registration CSV export",
+    "export_transactions": "📁 Transaction CSV export",
+    "wipe": "💨 Wipe all data",
+}
+FEEDBACK_LINK = "https://forms.gle/XUemm3T2YQQBMDhN9"  # ✅ Your actual Google Form link
+
+
+@st.cache_resource
+def get_admin_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="admin-job")
+
+
+def run_admin_job(job_id, func, *args):
+    def progress(done, total, message=None):
+        if not store.update_admin_job(job_id, done, total, message):
+            raise RuntimeError("Job is no longer running (marked interrupted).")
+
+    # A job marked interrupted while it waited in the queue is not started
+    if store.start_admin_job(job_id):
+        try:
+            # Jobs write any downloadable result to admin_job_chunks themselves
+            message, result_name = func(job_id, progress, *args)
+            store.finish_admin_job(job_id, "done", message, result_name)
+        except Exception as e:
+            print("❌ Admin job failed:", e)
+            store.finish_admin_job(job_id, "failed", f"❌ {e}")
+    try:
+        store.prune_admin_jobs()
+    except Exception as e:
+        print("❌ Pruning admin jobs failed:", e)
+
+
+def submit_admin_job(kind, func, *args):
+    job_id = uuid.uuid4().hex
+    store.create_admin_job(job_id, kind)
+    get_admin_executor().submit(run_admin_job, job_id, func, *args)
+    return job_id
+
+
+def feedback_email_job(job_id, progress):
+    users = store.list_usernames()
+    sent_count = 0
+    failed = []
+    for i, email in enumerate(users, start=1):
+        sent = send_email(
+            to_address=email,
+            subject="📋 We value your feedback!",
+            message_body=(
+                "Thank you for participating in our workshop! We'd love your feedback.\n\n"
+                f"Please take a moment to fill out this form: {FEEDBACK_LINK}\n\n"
+                "Your feedback helps us improve future events. 😊"
+            )
+        )
+        if sent:
+            sent_count += 1
+        else:
+            failed.append(email)
+        progress(i, len(users), f"Sent {sent_count} of {len(users)}")
+
+    message = f"✅ Feedback form sent to {sent_count} participants."
+    if failed:
+        message += f" ❌ Failed: {', '.join(failed)}"
+    return message, None
+
+
+def screenshot_preview_job(job_id, progress):
+    txn_ids = store.txn_ids_without_thumb()
+    skipped = 0
+    for i, txn_id in enumerate(txn_ids, start=1):
+        try:
+            img = Image.open(io.BytesIO(store.get_screenshot(txn_id)))
+            img.thumbnail((400, 400))
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, format="JPEG", quality=80)
+            store.save_screenshot_thumb(txn_id, buf.getvalue())
+        except Exception as e:
+            print(f"❌ Preview failed for {txn_id}:", e)
+            skipped += 1
+        progress(i, len(txn_ids))
+    return f"✅ Built {len(txn_ids) - skipped} screenshot previews ({skipped} skipped).", None
+
+
+def export_csv_job(job_id, progress, dataset):
+    rows = store.write_csv_export(job_id, dataset, progress)
+    return f"✅ Exported {rows} rows.", f"{dataset}.csv"
+
+
+def wipe_job(job_id, progress):
+    tables = store.WIPE_TABLES
+    for i, table in enumerate(tables, start=1):
+        store.wipe_table(table)
+        progress(i, len(tables), f"Wiped {table}")
+    store.wipe_admin_jobs(job_id)
+    return "✅ All data wiped successfully from the database.", None
+
+
+def prepare_admin_job_result(job_id):
+    st.session_state.prepared_job_result = (job_id, store.get_admin_job_result(job_id))
+
+
+def clear_admin_job_result():
+    st.session_state.pop("prepared_job_result", None)
+
+
+@st.fragment(run_every=ADMIN_JOB_POLL_SECONDS)
+def background_jobs_panel():
+    # Reruns on its own every few seconds; only job status rows are read on each poll
+    admin_jobs = store.list_admin_jobs()
+    now = time.time()
+    if any(job[2] in ("queued", "running") and now - job[7] > ADMIN_JOB_STALE_SECONDS for job in admin_jobs):
+        store.mark_stale_admin_jobs()  # persist 'interrupted' for jobs whose process is gone
+        admin_jobs = store.list_admin_jobs()
+    if not admin_jobs:
+        st.info("No background jobs yet.")
+
+    # A file is read from the database once, on an explicit click, and dropped after download
+    prepared_id, prepared_data = st.session_state.get("prepared_job_result", (None, None))
+    for job_id, kind, status, progress, total, message, result_name, updated_at in admin_jobs:
+        st.markdown(f"**{ADMIN_JOB_LABELS.get(kind, kind)}** — `{status}`")
+        if status in ("queued", "running"):
+            # Rows added during an export can push progress past the total counted at its start
+            st.progress(min(progress / total, 1.0) if total else 0.0, text=message or "Working...")
+        elif message:
+            st.caption(message)
+        if status == "done" and result_name:
+            if prepared_id == job_id and prepared_data is None:
+                st.warning(f"⚠️ {result_name} is no longer available. Run the export again.")
+            elif prepared_id == job_id:
+                st.download_button(f"📥 Download {result_name}", prepared_data, result_name, "text/csv",
+                                   key=f"job_{job_id}", on_click=clear_admin_job_result)
+            else:
+                st.button(f"📦 Prepare {result_name}", key=f"prepare_{job_id}",
+                          on_click=prepare_admin_job_result, args=(job_id,))
+
+
+# ✅ Windowed admin tables (keyset pagination; only page-start cursors live in the session)
+ADMIN_PAGE_SIZE = 50
+
+
+def paged_view(key, fetch_page, cursor_col, filters=()):
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+
+    df = fetch_page(cursors[-1], ADMIN_PAGE_SIZE + 1)
+    has_next = len(df) > ADMIN_PAGE_SIZE
+    df = df.iloc[:ADMIN_PAGE_SIZE]
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.button("⬅️ Previous", key=f"{key}_prev", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        next_cursor = df[cursor_col].iloc[-1] if has_next else None
+        st.button("Next ➡️", key=f"{key}_next", disabled=not has_next,
+                  on_click=cursors.append, args=(next_cursor,))
+    return df
+
 
 # Email validation function
 def is_valid_email(email):
@@ -171,14 +643,21 @@ if "txn_success" not in st.session_state:
 if "logout_triggered" not in st.session_state:
     st.session_state.logout_triggered = False
 
+cleanup_expired_sessions()
+
+# Returning user: restore login from the session token in one indexed read
+if (
+    not st.session_state.user_logged_in
+    and not st.session_state.admin_logged_in
+    and not st.session_state.logout_triggered
+    and "session" in st.query_params
+):
+    restore_session()
+
 
 def get_sidebar_choice():
     if st.session_state.user_logged_in:
-        c = conn.cursor()
-        c.execute("SELECT name1, reg1, year1 FROM teams WHERE username=?", (st.session_state.username,))
-        row = c.fetchone()
-        has_team = row and all(row)
-        if has_team:
+        if store.has_team(st.session_state.username):
             menu = ["Team Selection", "Transaction", "Logout"]
         else:
             menu = ["Team Selection", "Logout"]
@@ -237,14 +716,11 @@ if not st.session_state.user_logged_in and not st.session_state.admin_logged_in:
                 elif not is_valid_email(username):
                     st.error("Please enter a valid email address.")
                 else:
-                    c = conn.cursor()
-                    c.execute("SELECT 1 FROM users WHERE username=?", (username,))
-                    if c.fetchone():
+                    if store.user_exists(username):
                         st.error("This email is already registered. Please login.")
                     else:
                         try:
-                            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-                            conn.commit()
+                            store.create_user(username, password)
                             st.success("Registered successfully. Please login.")
                             send_email(
                                 username,
@@ -263,14 +739,14 @@ if not st.session_state.user_logged_in and not st.session_state.admin_logged_in:
             if login_btn:
                 if username == "admin" and password == "admin123":
                     st.session_state.admin_logged_in = True
+                    start_session("admin", is_admin=True)
                     st.success("Admin login successful.")
                     safe_rerun()
                 else:
-                    c = conn.cursor()
-                    c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-                    if c.fetchone():
+                    if store.check_login(username, password):
                         st.session_state.user_logged_in = True
                         st.session_state.username = username
+                        start_session(username)
                         st.success("Logged in successfully!")
                         safe_rerun()  # 🚨 This restarts the app, so don't put anything after it.
                     else:
@@ -352,16 +828,11 @@ elif choice and choice == "Team Selection":
     if "username" in st.session_state and st.session_state.username != st.session_state.get("last_team_user"):
     # This block executes when a new user logs in
         st.session_state.pop("team_saved_successfully", None)
-        st.session_state.pop("qr_details", None)
-        st.session_state.pop("qr_team_size", None)
-        st.session_state.pop("team_code", None)
         st.session_state.pop("clear_team_form", None)
 
     # Store the current username to prevent this from running on every rerun
         st.session_state.last_team_user = st.session_state.username
         st.rerun()
-    
-    import uuid  # Required for generating team code
 
     st.title("Team Selection")
     team_size = st.radio("Select Team Size", ["Single (₹50)", "Duo (₹80)", "Trio (₹100)"])
@@ -401,17 +872,8 @@ elif choice and choice == "Team Selection":
             if not details[0].strip() or not details[1].strip() or not details[2].strip():
                 st.error("❌ Please fill at least the first member's Name, Reg Number, and Year.")
             else:
-                c = conn.cursor()
-                c.execute("DELETE FROM teams WHERE username=?", (st.session_state.username,))
-                placeholders = ",".join(["?"] * 17)
-                c.execute(f"INSERT INTO teams VALUES ({placeholders})",
-                          (st.session_state.username, team_size, *details, *[""] * (15 - len(details))))
-                conn.commit()
-
-                team_code = f"DAVTEAM-{uuid.uuid4().hex[:8].upper()}"
-                st.session_state.team_code = team_code
-                st.session_state.qr_details = details
-                st.session_state.qr_team_size = size
+                bundle = build_team_bundle(st.session_state.username, team_size, details)
+                store.save_team(st.session_state.username, team_size, details, bundle)
                 st.session_state.team_saved_successfully = True
 
         # ✅ Clear form inputs after submission
@@ -422,23 +884,11 @@ elif choice and choice == "Team Selection":
                 safe_rerun()
 
 
-    # ✅ After rerun, show QR and transaction link
-    if (
-        st.session_state.get("team_saved_successfully")
-        and "qr_details" in st.session_state
-        and "qr_team_size" in st.session_state
-        and "team_code" in st.session_state
-    ):
-        details = st.session_state.qr_details
-        size = st.session_state.qr_team_size
-        team_code = st.session_state.team_code
-
-        team_info = f"Team Code: {team_code}\n"
-        team_info += f"Team Leader: {details[0]} ({details[1]})\n"
-        for i in range(1, size):
-            team_info += f"Member {i+1}: {details[i*5]} ({details[i*5+1]})\n"
-
-        qr_bytes = generate_team_qr(team_info)
+    # ✅ After rerun, show QR and transaction link (read from the stored team bundle)
+    bundle = get_team_bundle(st.session_state.username) if st.session_state.get("team_saved_successfully") else None
+    if bundle:
+        team_info = format_team_info(bundle["team_code"], bundle["members"])
+        qr_bytes = bundle["qr_png"]
 
         st.success("✅ Team saved successfully!")
         st.image(qr_bytes, caption="Your Team QR Code", width=250)
@@ -457,20 +907,19 @@ elif choice == "Transaction":
     if "txn_success" not in st.session_state:
         st.session_state.txn_success = False
 
-    team_cost = {"Single (₹50)": 50, "Duo (₹80)": 80, "Trio (₹100)": 100}
     qr_map = {
         "Single (₹50)": "qr-code.png",
         "Duo (₹80)": "qr-code (1).png",
         "Trio (₹100)": "qr-code (2).png"
     }
 
-    c = conn.cursor()
-    c.execute("SELECT team_size FROM teams WHERE username=?", (st.session_state.username,))
-    row = c.fetchone()
+    # One bundle read per view: metadata only, plus the PDF once there is a payment to confirm
+    job = store.latest_payment_job(st.session_state.username)
+    bundle = get_team_bundle(st.session_state.username, blobs=("pdf",) if job else ())
 
-    if row:
-        team_size = row[0]
-        price = team_cost.get(team_size)
+    if bundle:
+        team_size = bundle["team_size"]
+        price = bundle["price"]
         qr_file = f"workshop_app_streamlit/{qr_map.get(team_size)}"
 
         st.write(f"Team Size: {team_size}")
@@ -495,71 +944,39 @@ elif choice == "Transaction":
                     st.error("❌ Please upload the transaction screenshot.")
                 else:
                     # ✅ Check if the transaction ID already exists in the database
-                    c.execute("SELECT txn_id FROM transactions WHERE txn_id = ?", (txn_id,))
-                    existing_txn = c.fetchone()
-
-                    if existing_txn:
+                    if store.txn_exists(txn_id):
                         st.error("❌ Transaction ID already exists. Please check your entry.")
                     else:
                         # ✅ Insert the new transaction if ID is unique
                         image_bytes = screenshot.read()
-                        c.execute(
-                            "REPLACE INTO transactions (username, amount, txn_id, screenshot) VALUES (?, ?, ?, ?)",
-                            (st.session_state.username, price, txn_id, image_bytes)
-                        )
-                        conn.commit()
-                        st.session_state.last_txn_id = txn_id
-                        st.session_state.last_price = price
+                        store.add_transaction(st.session_state.username, price, txn_id, image_bytes)
+                        payment_worker_wake.set()
                         st.session_state.txn_success = True
                         st.success("✅ Transaction submitted successfully.")
                         safe_rerun()
     else:
         st.warning("⚠️ Please fill out team details first on the 'Team Selection' page.")
 
-    # ✅ After rerun - show WhatsApp join link and confirmation
-    if st.session_state.txn_success:
-        st.success("Transaction recorded successfully!")
-
-        # ✅ Fetch team details from DB
-        c.execute("SELECT * FROM teams WHERE username=?", (st.session_state.username,))
-        team_row = c.fetchone()
-        if team_row:
-            team_size = team_row[1]
-            members = []
-            for i in range(1, 4):
-                name = team_row[2 + (i - 1) * 5]
-                reg = team_row[3 + (i - 1) * 5]
-                year = team_row[4 + (i - 1) * 5]
-                branch = team_row[5 + (i - 1) * 5]
-                section = team_row[6 + (i - 1) * 5]
-                if name and reg:
-                    members.append({
-                        "name": name,
-                        "reg": reg,
-                        "year": year,
-                        "branch": branch,
-                        "section": section
-                    })
-
-            team_data = {"team_size": team_size, "members": members}
-            pdf_bytes = generate_team_pdf(team_data, st.session_state.username)
-
-            # ✅ Send email with PDF
-            try:
-                send_email_with_pdf(
-                    to_address=st.session_state.username,
-                    subject="Workshop Payment Received 💰",
-                    message_body=(
-                        f"Hi,\n\nYour payment of ₹{st.session_state.last_price} was received successfully. "
-                        f"Your transaction ID is: {st.session_state.last_txn_id}.\n\n"
-                        f"Attached is your team confirmation.\n\nThanks for registering!"
-                    ),
-                    pdf_bytes=pdf_bytes,
-                    filename="team_info.pdf"
-                )
-                st.success("📧 Confirmation email with team PDF sent.")
-            except Exception as e:
-                st.warning(f"📧 Email failed to send: {e}")
+    # ✅ Confirmation status - the PDF and email are handled once by the payment worker
+    if job:
+        _, _, _, job_status, job_error, job_attempts = job
+        if st.session_state.txn_success:
+            st.success("Transaction recorded successfully!")
+            st.session_state.txn_success = False
+
+        if job_status in ("pending", "running"):
+            st.info("⏳ Preparing your team PDF and confirmation email...")
+            st.button("🔄 Refresh Status")
+        elif job_status == "done":
+            st.success("📧 Confirmation email with team PDF sent.")
+        elif (job_attempts or 0) < PAYMENT_JOB_MAX_ATTEMPTS:
+            st.warning(f"📧 Email failed to send: {job_error} We will retry automatically in a few minutes.")
+        else:
+            st.warning(f"📧 Email failed to send: {job_error}")
+
+        if bundle:
+            st.download_button("📥 Download Team PDF", data=bundle["pdf"], file_name="team_info.pdf",
+                               mime="application/pdf")
 
         # ✅ Show WhatsApp join button
         st.markdown(
@@ -576,31 +993,20 @@ elif choice == "Transaction":
             unsafe_allow_html=True
         )
 
-        st.session_state.txn_success = False
-
-
-
-
-
-    else:
-        st.warning("⚠️ Please fill out team details first on the 'Team Selection' page.")
-
 # Admin Panel
 
 
 elif choice == "Admin" and st.session_state.admin_logged_in:
     st.title("Admin Panel")
+
+    # ✅ Background jobs started from this panel (safe to navigate away; progress is stored)
+    st.subheader("⚙️ Background Jobs")
+    background_jobs_panel()
+
     st.subheader("Download Registration Details")
-    reg_df = pd.read_sql_query("SELECT * FROM teams", conn)
-
-    # 💰 Total Revenue Generated (All Registrations)
-    total_df = reg_df.copy()
-    team_price_map = {
-        "Single (₹50)": 50,
-        "Duo (₹80)": 80,
-        "Trio (₹100)": 100
-    }
-    total_revenue = sum(team_price_map.get(ts, 0) for ts in total_df["team_size"])
+
+    # 💰 Total Revenue Generated (All Registrations) - counted in SQL, no rows loaded
+    total_revenue = sum(TEAM_PRICES.get(ts, 0) * count for ts, count in store.team_size_counts().items())
 
     st.markdown("""
     <div style='
@@ -623,55 +1029,36 @@ elif choice == "Admin" and st.session_state.admin_logged_in:
     section_filter = st.selectbox("Filter by Section", options=["All", "A", "B", "C", "D"])
     team_size_filter = st.selectbox("Filter by Team Size", options=["All", "Single (₹50)", "Duo (₹80)", "Trio (₹100)"])
 
-    filtered_df = reg_df.copy()
-
-    if year_filter != "All":
-        filtered_df = filtered_df[
-            (filtered_df["year1"] == year_filter) |
-            (filtered_df["year2"] == year_filter) |
-            (filtered_df["year3"] == year_filter)
-        ]
-
-    if branch_filter != "All":
-        filtered_df = filtered_df[
-            (filtered_df["branch1"] == branch_filter) |
-            (filtered_df["branch2"] == branch_filter) |
-            (filtered_df["branch3"] == branch_filter)
-        ]
-
-    if section_filter != "All":
-        filtered_df = filtered_df[
-            (filtered_df["section1"] == section_filter) |
-            (filtered_df["section2"] == section_filter) |
-            (filtered_df["section3"] == section_filter)
-        ]
-
-    if team_size_filter != "All":
-        filtered_df = filtered_df[filtered_df["team_size"] == team_size_filter]
+    filters = {
+        "year": None if year_filter == "All" else year_filter,
+        "branch": None if branch_filter == "All" else branch_filter,
+        "section": None if section_filter == "All" else section_filter,
+        "team_size": None if team_size_filter == "All" else team_size_filter,
+    }
+    filtered_df = paged_view(
+        "reg",
+        lambda after, limit: store.teams_page(after, limit, **filters),
+        "username",
+        tuple(filters.values())
+    )
 
     st.dataframe(filtered_df)
 
     # ✅ Summary Stats
     st.subheader("📊 Summary Stats")
 
-    total_filtered_teams = len(filtered_df)
-    team_price_map = {
-        "Single (₹50)": 50,
-        "Duo (₹80)": 80,
-        "Trio (₹100)": 100
-    }
-    total_filtered_revenue = sum(team_price_map.get(ts, 0) for ts in filtered_df["team_size"])
-    team_size_counts = filtered_df["team_size"].value_counts()
+    team_size_counts = store.team_size_counts(**filters)
+    total_filtered_teams = sum(team_size_counts.values())
+    total_filtered_revenue = sum(TEAM_PRICES.get(ts, 0) * count for ts, count in team_size_counts.items())
 
     st.markdown(f"- Total Filtered Teams: **{total_filtered_teams}**")
     st.markdown(f"- Revenue from Filtered Teams: **₹{total_filtered_revenue}**")
-    for team_label, count in team_size_counts.items():
+    for team_label, count in sorted(team_size_counts.items(), key=lambda item: -item[1]):
         st.markdown(f"- {team_label}: {count} teams")
 
     # ✅ Branch-wise chart from filtered data
     st.subheader("📈 Branch-wise Registration Chart")
-    chart_df = filtered_df["branch1"].value_counts().reset_index()
-    chart_df.columns = ["Branch", "Count"]
+    chart_df = store.branch_counts(**filters)
 
     chart = alt.Chart(chart_df).mark_bar().encode(
     x=alt.X("Branch:N", sort='-y', axis=alt.Axis(labelColor='white', titleColor='white')),
@@ -696,26 +1083,32 @@ elif choice == "Admin" and st.session_state.admin_logged_in:
 
     # ✅ Full Data Download
     st.subheader("📁 Download Full Data")
-    st.dataframe(reg_df)
-    st.download_button("Download Registration CSV", reg_df.to_csv(index=False), "registrations.csv", "text/csv")
+    if st.button("Prepare Registration CSV"):
+        submit_admin_job("export_registrations", export_csv_job, "registrations")
+        st.info("⏳ Export started. Download it from **Background Jobs** when it is done.")
 
     st.subheader("Download Transaction Details")
-    txn_df = pd.read_sql_query("SELECT username, amount, txn_id FROM transactions", conn)
+    txn_df = paged_view("txn", store.transactions_page, "txn_id")
     st.dataframe(txn_df)
-    st.download_button("Download Transaction CSV", txn_df.to_csv(index=False), "transactions.csv", "text/csv")
+    if st.button("Prepare Transaction CSV"):
+        submit_admin_job("export_transactions", export_csv_job, "transactions")
+        st.info("⏳ Export started. Download it from **Background Jobs** when it is done.")
 
     # ✅ Screenshot Preview
     st.subheader("🖼️ Preview Uploaded Screenshots and Amounts")
-    c = conn.cursor()
-    c.execute("SELECT username, amount, txn_id, screenshot FROM transactions")
-    txn_rows = c.fetchall()
-
-    for idx, (username, amount, txn_id, screenshot_blob) in enumerate(txn_rows):
+    if st.button("🛠️ Build Screenshot Previews"):
+        submit_admin_job("previews", screenshot_preview_job)
+        st.info("⏳ Building previews in the background. Follow progress under **Background Jobs**.")
+    st.caption("Showing the transactions on the current page above.")
+    thumbs = store.screenshot_thumbs(list(txn_df["txn_id"]))
+
+    for username, amount, txn_id in txn_df.itertuples(index=False):
+        thumb_blob = thumbs.get(txn_id)
         st.markdown(f"**👤 Username:** `{username}`  \n**💸 Amount Paid:** ₹{amount}  \n**🔖 Transaction ID:** `{txn_id}`")
 
-        if screenshot_blob:
-            b64 = base64.b64encode(screenshot_blob).decode()
-            file_ext = "png"
+        if thumb_blob:
+            b64 = base64.b64encode(thumb_blob).decode()
+            file_ext = "jpeg"
             img_html = f'''
             <style>
             .tooltip-container {{
@@ -747,9 +1140,48 @@ elif choice == "Admin" and st.session_state.admin_logged_in:
             '''
             st.markdown(img_html, unsafe_allow_html=True)
         else:
-            st.info("No screenshot uploaded.")
+            st.info("Preview not built yet. Use **Build Screenshot Previews** above.")
         st.markdown("---")
 
+    # ✅ Backups & Snapshots
+    st.subheader("🗄️ Backups & Snapshots")
+    if store.dialect != "sqlite":
+        st.info(f"Snapshots are only managed here for the SQLite backend (current: {store.dialect}).")
+    elif st.button("Create Backup Now"):
+        try:
+            path = backup_db()
+            st.success(f"✅ Backup created and verified: {os.path.basename(path)}")
+        except Exception as e:
+            st.error(f"❌ Backup failed: {e}")
+
+    backups = list_backups() if store.dialect == "sqlite" else []
+    if backups:
+        backup_df = pd.DataFrame([
+            {
+                "Snapshot": os.path.basename(path),
+                "Created": datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S"),
+                "Size (KB)": round(os.path.getsize(path) / 1024, 1),
+            }
+            for path in backups
+        ])
+        st.dataframe(backup_df)
+
+        with st.form("restore_form"):
+            snapshot_name = st.selectbox("Snapshot to restore", [os.path.basename(p) for p in backups])
+            restore_pwd = st.text_input("Enter Admin Password to Confirm", type="password")
+            confirm_restore = st.form_submit_button("Restore Snapshot")
+            if confirm_restore:
+                if restore_pwd == "admin6677":
+                    try:
+                        restore_backup(os.path.join(BACKUP_DIR, snapshot_name))
+                        st.success(f"✅ Restored {snapshot_name}. A safety backup of the previous data was taken.")
+                    except Exception as e:
+                        st.error(f"❌ Restore failed: {e}")
+                else:
+                    st.error("❌ Incorrect password. Restore operation aborted.")
+    elif store.dialect == "sqlite":
+        st.info("No backups yet.")
+
     # ✅ Wipe Data Section
     st.subheader("💨 Danger Zone: Wipe All Data")
     with st.form("wipe_form"):
@@ -757,12 +1189,8 @@ elif choice == "Admin" and st.session_state.admin_logged_in:
         confirm_wipe = st.form_submit_button("Wipe All Data")
         if confirm_wipe:
             if admin_pwd == "admin6677":
-                c.execute("DELETE FROM users")
-                c.execute("DELETE FROM teams")
-                c.execute("DELETE FROM transactions")
-                conn.commit()
-                st.success("✅ All data wiped successfully from the database.")
-                safe_rerun()
+                submit_admin_job("wipe", wipe_job)
+                st.success("⏳ Wipe started. Follow its progress under **Background Jobs**.")
             else:
                 st.error("❌ Incorrect password. Wipe operation aborted.")
 
@@ -775,41 +1203,19 @@ elif choice == "Admin" and st.session_state.admin_logged_in:
 
         if send_form:
             if feedback_pwd == "admin6677":
-                feedback_link = "https://forms.gle/XUemm3T2YQQBMDhN9"  # ✅ Your actual Google Form link
-
-                c.execute("SELECT username FROM users")
-                users = c.fetchall()
-
-                sent_count = 0
-                for (email,) in users:
-                    try:
-                        send_email(
-                            to_address=email,
-                            subject="📋 We value your feedback!",
-                            message_body=(
-                                "Thank you for participating in our workshop! We'd love your feedback.\n\n"
-                                f"Please take a moment to fill out this form: {feedback_link}\n\n"
-                                "Your feedback helps us improve future events. 😊"
-                            )
-                        )
-                        sent_count += 1
-                    except Exception as e:
-                        st.warning(f"❌ Failed to send to {email}: {e}")
-
-                st.success(f"✅ Feedback form sent to {sent_count} participants.")
+                submit_admin_job("feedback", feedback_email_job)
+                st.success("⏳ Sending feedback emails in the background. Follow progress under **Background Jobs**.")
             else:
                 st.error("❌ Incorrect admin password.")
 
 
 # Logout
 elif choice == "Logout":
+    end_session()
     st.session_state.logout_triggered = True
     for key in ["user_logged_in", "admin_logged_in", "username", "menu_redirect"]:
         st.session_state.pop(key, None)
     st.session_state.pop("team_saved_successfully", None)
-    st.session_state.pop("qr_details", None)
-    st.session_state.pop("qr_team_size", None)
-    st.session_state.pop("team_code", None)
     st.session_state.pop("clear_team_form", None)
     st.session_state.pop("last_team_user", None)
     st.success("✅ Logged out successfully! Redirecting to home...")